@@ -9,7 +9,7 @@ import logging
 import src.utils as utils
 
 from .config import *
-from .merkle import merkle_tree
+from .merkle import merkle_root_hash
 from .crypto import get_hasher
 
 __all__ = ['Block']
@@ -56,7 +56,7 @@ class Block:
         self.received_time = received_time
         self.target = target
         self.transactions = transactions
-        self._hash = self._get_hash()
+        self.hash = self._get_hash()
 
     @property
     def hash(self):
@@ -65,6 +65,8 @@ class Block:
     @hash.setter
     def hash(self, value):
         self._hash = value
+        # the proof of work compares the hash as a number, so convert it only once
+        self._hash_int = int.from_bytes(value, 'big')
 
     def to_json_compatible(self):
         """ Returns a JSON-serializable representation of this object. """
@@ -99,7 +101,6 @@ class Block:
         """
         Create a new block for a certain blockchain, containing certain transactions.
         """
-        tree = merkle_tree(transactions)
         difficulty = chain_difficulty
         id = prev_block.height + 1
         if ts is None:
@@ -107,7 +108,7 @@ class Block:
         if ts <= prev_block.time:
             ts = prev_block.time + timedelta(microseconds=1)
         return Block(prev_block.hash, ts, 0, prev_block.height + 1,
-                     None, difficulty, transactions, tree.get_hash(), id)
+                     None, difficulty, transactions, merkle_root_hash(transactions), id)
 
     def __str__(self):
         return json.dumps(self.to_json_compatible(), indent=4)
@@ -141,11 +142,11 @@ class Block:
 
     def verify_merkle(self):
         """ Verify that the merkle root hash is correct for the transactions in this block. """
-        return merkle_tree(self.transactions).get_hash() == self.merkle_root_hash
+        return merkle_root_hash(self.transactions) == self.merkle_root_hash
 
     def verify_proof_of_work(self):
         """ Verify the proof of work on a block. """
-        return int.from_bytes(self._hash, 'big') < self.target
+        return self._hash_int < self.target
 
     def verify_difficulty(self):
         """ Verifies that the hash value is correct and fulfills its target promise. """
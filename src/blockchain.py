@@ -7,7 +7,7 @@ from binascii import hexlify
 
 from collections import namedtuple
 
-from typing import Optional
+from typing import Optional, FrozenSet
 
 from datetime import datetime
 
@@ -48,6 +48,7 @@ class Blockchain:
         self.block_indices = {GENESIS_BLOCK_HASH: 0}
         self.unspent_coins = {}
         self.total_difficulty = 0
+        self._checkpoint_hashes = None
 
     def try_append(self, block: 'Block') -> 'Optional[Blockchain]':
         """
@@ -89,6 +90,25 @@ class Blockchain:
             return None
         return self.blocks[idx]
 
+    @property
+    def checkpoint_hashes(self) -> 'FrozenSet[bytes]':
+        """
+        The hashes of the blocks whose chains are kept as checkpoints while this chain is the
+        primary block chain: the genesis block and blocks at exponentially shrinking distances
+        towards the head. Computed on first use and cached.
+        """
+        if self._checkpoint_hashes is None:
+            hashes = {GENESIS_BLOCK_HASH}
+            chain_len = len(self.blocks)
+            idx = 0
+            while chain_len > 1:
+                cp = 1 << (chain_len.bit_length() - 2)
+                idx += cp
+                hashes.add(self.blocks[idx].hash)
+                chain_len -= cp
+            self._checkpoint_hashes = frozenset(hashes)
+        return self._checkpoint_hashes
+
     @property
     def head(self):
         """
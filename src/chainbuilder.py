@@ -6,8 +6,20 @@ but not yet part of the primary block chain, or valid once another unconfirmed t
 becomes valid.
 
 Received blocks that cannot be shown to be invalid on *any* block chain are stored in a block
-cache (from which for the moment they are never evicted), so that they do not need to be requested
-from other peers over and over again.
+cache, so that they do not need to be requested from other peers over and over again. The cache
+is bounded by evicting blocks that are neither part of the primary block chain nor of a partial
+chain; only the blocks that are not part of the primary block chain count towards its size. As
+peers decide which blocks end up in the cache, the victims are not chosen by a strict least
+recently used policy, which would be easy to predict, but by sampling two random blocks and
+evicting the one that was used less recently. Blocks that are used by a partial chain again after
+they were kept in serialized form (see below) are protected (as in a segmented LRU cache) and only
+evicted when both sampled blocks are protected, so that streams of blocks that are never used again
+cannot push them out. Requests from peers do not protect blocks, so that peers cannot choose which
+blocks are protected. Blocks that are already cached, which includes all blocks of the primary
+block chain, are dropped without verifying them again.
+Blocks that are unlikely to be needed again (those that are no longer part of the primary block
+chain or of a partial chain) are kept in the cache only in serialized form, and deserialized again
+when they are requested.
 
 
 For the process of building new primary block chains, block requests are used. These are maintained
@@ -16,6 +28,15 @@ progress. Each block request stores a list of partial block chains that all depe
 next block, and the time of the last download request, so that these requests can be retried and
 at some point aborted when no progress is made.
 
+Partial chains are not stored as lists of blocks: a partial chain is represented by its youngest
+block, and the older blocks are found by following the previous block pointers through the block
+cache. To find the oldest block of a partial chain without walking through the cache one block at a
+time, the chain builder keeps a table of ancestor pointers for every cached block (the `2**k`-th
+ancestor for each `k`, also known as binary lifting), so that this takes only `O(log N)` steps.
+As blocks can arrive before their ancestors, these tables are extended whenever they are used. Only
+blocks without cached children are evicted from the block cache, so that no ancestor pointer ever
+skips over a block missing from the cache.
+
 While not strictly necessary, the block requests are also used when the block can be found in the
 block cache. In that case they are immediately fulfilled until the block chains can be built or a
 block is missing in the cache, which then will be requested from the peers.
@@ -28,62 +49,138 @@ block.
 """
 import threading
 import logging
-import math
-from typing import List, Optional
-from datetime import datetime
+import json
+import heapq
+import random
+import time
+from collections import deque, namedtuple, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice, repeat
+from typing import Deque, Iterable, List, Optional, Set, Tuple, Union
 
 from .config import *
 from .block import Block
 from .blockchain import Blockchain, GENESIS_BLOCK, GENESIS_BLOCK_HASH
 from .protocol import Protocol
+from .transaction import Transaction
 
 __all__ = ['ChainBuilder']
 
 
+class _ColdBlock(namedtuple("_ColdBlock", ["hash", "prev_block_hash", "height", "raw"])):
+    """
+    The compact form of a block in the block cache that is unlikely to be needed again. Can be
+    sent to peers without deserializing it.
+
+    :ivar hash: The hash of the block.
+    :vartype hash: bytes
+    :ivar prev_block_hash: The hash of the previous block.
+    :vartype prev_block_hash: bytes
+    :ivar height: The height of the block.
+    :vartype height: int
+    :ivar raw: The JSON serialization of the block.
+    :vartype raw: bytes
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_block(cls, block: 'Block') -> '_ColdBlock':
+        """ Serializes `block` into its compact form. """
+        return cls(block.hash, block.prev_block_hash, block.height,
+                   json.dumps(block.to_json_compatible()).encode())
+
+    def to_json_compatible(self):
+        """ Returns a JSON-serializable representation of the block. """
+        return json.loads(self.raw.decode())
+
+    def to_block(self) -> 'Block':
+        """ Deserializes the block again. """
+        return Block.from_json_compatible(self.to_json_compatible())
+
+
 class BlockRequest:
     """
     Stores information about a pending block request and the partial chains that depend on it.
 
-    :ivar partial_chains: The partial chains that wait for this request. These partial chains are
-                          ordered by age, youngest first.
-    :vartype partial_chains: List[List[Block]]
-    :ivar _last_update: The time and date of the last block request to our peers.
-    :vartype _last_update: datetime
+    :ivar block_hash: The hash of the block this request is waiting for.
+    :vartype block_hash: bytes
+    :ivar height: The height of the block this request is waiting for, as claimed by its successor.
+    :vartype height: int
+    :ivar partial_chains: The partial chains that wait for this request, each represented by its
+                          youngest block.
+    :vartype partial_chains: List[Block]
+    :ivar _last_update: The time of the last block request to our peers, according to
+                        `time.monotonic()`.
+    :vartype _last_update: float
     :ivar _request_count: The number of requests to our peers we have sent.
     :vartype _request_count: int
+    :ivar _lowest_requested_height: The height of the oldest block that the last request to our
+                                    peers asked for.
+    :vartype _lowest_requested_height: int
     """
 
-    def __init__(self):
-        self.partial_chains = [[]]
-        self.clear()
+    __slots__ = ('block_hash', 'height', 'partial_chains', '_last_update', '_request_count',
+                 '_lowest_requested_height')
 
-    def clear(self):
-        """ Clears the download count and last update time of this request. """
-        self._last_update = datetime(1970, 1, 1)
+    def __init__(self, block_hash: bytes, height: int):
+        self.block_hash = block_hash
+        self.height = height
+        self.partial_chains = []
+        self._last_update = float('-inf')
         self._request_count = 0
+        self._lowest_requested_height = height + 1
 
-    def send_request(self, protocol: 'Protocol'):
-        """ Sends a request for the next required block to the given `protocol`. """
+    def send_request(self, protocol: 'Protocol', primary_height: int, now: float) -> None:
+        """
+        Sends a request for the next required block to the given `protocol`. As long as we are
+        behind the primary block chain of height `primary_height`, its predecessors are requested
+        as well. `now` is the current `time.monotonic()`.
+        """
         self._request_count += 1
-        self._last_update = datetime.utcnow()
-        protocol.send_block_request(self.partial_chains[0][-1].prev_block_hash)
-        logging.debug("asking for another block %d (attempt %d)", max(len(r) for r in self.partial_chains),
-                      self._request_count)
+        self._last_update = now
+        count = min(MAX_BLOCKS_PER_REQUEST, max(1, self.height - primary_height))
+        self._lowest_requested_height = self.height - count + 1
+        protocol.send_block_request(self.block_hash, count)
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug("asking for another block %d (attempt %d)", max(r.height for r in self.partial_chains),
+                          self._request_count)
+
+    def continue_request(self, fulfilled: 'BlockRequest', now: float) -> None:
+        """
+        Takes over the last request to our peers of the block request `fulfilled`, whose block was
+        just received and is a descendant of ours, if that request asked for our block as well.
+        Peers send such a batch newest block first, so our block is on its way. `now` is the current
+        `time.monotonic()`.
+        """
+        if self.height >= fulfilled._lowest_requested_height:
+            self._lowest_requested_height = fulfilled._lowest_requested_height
+            self._request_count = fulfilled._request_count
+            self._last_update = now
+
     def timeout_reached(self) -> bool:
         """ Returns a bool indicating whether all attempts to download this block have failed. """
         return self._request_count > BLOCK_REQUEST_RETRY_COUNT
 
-    def checked_retry(self, protocol: 'Protocol'):
+    def retry_deadline(self) -> float:
+        """
+        Returns the `time.monotonic()` after which this request is retried. The time we wait for a
+        response doubles with every attempt.
+        """
+        interval = min(BLOCK_REQUEST_RETRY_INTERVAL * 2 ** max(0, self._request_count - 1),
+                       BLOCK_REQUEST_MAX_RETRY_INTERVAL)
+        return self._last_update + interval
+
+    def checked_retry(self, protocol: 'Protocol', primary_height: int, now: float) -> None:
         """
         Retries sending this request, if no response was received for a certain time or if no
-        request was sent yet.
+        request was sent yet. `now` is the current `time.monotonic()`.
         """
 
-        if self._last_update + BLOCK_REQUEST_RETRY_INTERVAL < datetime.utcnow():
+        if self.retry_deadline() < now:
             if self._request_count >= BLOCK_REQUEST_RETRY_COUNT:
                 self._request_count += 1
             else:
-                self.send_request(protocol)
+                self.send_request(protocol, primary_height, now)
 
 
 class ChainBuilder:
@@ -98,10 +195,54 @@ class ChainBuilder:
     :vartype primary_block_chain: Blockchain
     :ivar _block_requests: A dict from block hashes to lists of partial chains waiting for that block.
     :vartype _block_requests: Dict[bytes, BlockRequest]
+    :ivar _blockchain_checkpoints: Snapshots of the primary block chain, indexed by the hash of their
+                                   head. Pruned on every new primary block chain so that only
+                                   `O(log N)` of them are kept.
+    :vartype _blockchain_checkpoints: Dict[bytes, Blockchain]
     :ivar block_cache: A cache of received blocks, not bound to any one specific block chain.
-    :vartype block_cache: Dict[bytes, Block]
+                       Blocks that are unlikely to be needed again are stored in compact form.
+    :vartype block_cache: Dict[bytes, Union[Block, _ColdBlock]]
+    :ivar _cache_keys: The keys of the block cache that are not part of the primary block chain, for
+                       sampling eviction candidates.
+    :vartype _cache_keys: List[bytes]
+    :ivar _cache_key_indices: The position of each key in `_cache_keys`.
+    :vartype _cache_key_indices: Dict[bytes, int]
+    :ivar _cache_last_used: The monotonic clock time each cached block was last used.
+    :vartype _cache_last_used: Dict[bytes, float]
+    :ivar _protected_cache_hashes: The cached blocks that were used by a partial chain again after
+                                   they were demoted, least recently used first. At most
+                                   `BLOCK_CACHE_PROTECTED_SIZE`.
+    :vartype _protected_cache_hashes: OrderedDict[bytes, None]
+    :ivar _partial_chains_by_height: A min-heap of the partial chains of all block requests, as tuples
+                                     of the partial chain's height, its id, the hash of the block it
+                                     waits for and the partial chain itself. May contain partial
+                                     chains that were already removed from their block request.
+    :vartype _partial_chains_by_height: List[Tuple[int, int, bytes, Block]]
+    :ivar _requests_by_deadline: A min-heap of the block requests that did not time out yet, as
+                                 tuples of their retry deadline, their id, the hash of the block
+                                 they wait for and the request itself. Each request is in there at
+                                 most once; requests that were removed from `_block_requests` are
+                                 skipped once they come up.
+    :vartype _requests_by_deadline: List[Tuple[float, int, bytes, BlockRequest]]
+    :ivar _timed_out_requests: The hashes of the block requests that timed out since the last call
+                               of `_clean_block_requests`.
+    :vartype _timed_out_requests: List[bytes]
+    :ivar _ancestors: For each block in the block cache, the hashes of its `2**k`-th ancestors, as far
+                      as they could be determined from the block cache.
+    :vartype _ancestors: Dict[bytes, List[bytes]]
+    :ivar _cached_children: The number of cached blocks whose previous block is the given hash.
+    :vartype _cached_children: Dict[bytes, int]
     :ivar unconfirmed_transactions: Known transactions that are not part of the primary block chain.
     :vartype unconfirmed_transactions: Dict[bytes, Transaction]
+    :ivar _unconfirmed_by_input: An index from the inputs of unconfirmed transactions to the hashes of
+                                 the unconfirmed transactions spending them.
+    :vartype _unconfirmed_by_input: Dict[Tuple[bytes, int], Set[bytes]]
+    :ivar _tx_verify_cache: For the heads of the checkpoints, the results of verifying unconfirmed
+                            transactions on top of them, indexed by transaction hash.
+    :vartype _tx_verify_cache: Dict[bytes, Dict[bytes, bool]]
+    :ivar _unverified_transactions: Hashes of the unconfirmed transactions that were not yet verified
+                                    on top of the primary block chain.
+    :vartype _unverified_transactions: Set[bytes]
     :ivar chain_change_handlers: Event handlers that get called when we find out about a new primary
                                  block chain.unconfirmed_transactions
     :vartype chain_change_handlers: List[Callable]
@@ -110,15 +251,30 @@ class ChainBuilder:
     :vartype transaction_change_handlers: List[Callable]
     :ivar protocol: The protocol instance used by this chain builder.
     :vartype protocol: Protocol
+    :ivar _verify_executor: Worker threads used to verify competing partial chains and unconfirmed
+                            transactions concurrently.
+    :vartype _verify_executor: ThreadPoolExecutor
     """
 
     def __init__(self, protocol: 'Protocol'):
         self.primary_block_chain = Blockchain()
         self._block_requests = {}
+        self._partial_chains_by_height = []
+        self._requests_by_deadline = []
+        self._timed_out_requests = []
         self._blockchain_checkpoints = {GENESIS_BLOCK_HASH: self.primary_block_chain}
 
         self.block_cache = {GENESIS_BLOCK_HASH: GENESIS_BLOCK}
+        self._cache_keys = []
+        self._cache_key_indices = {}
+        self._cache_last_used = {GENESIS_BLOCK_HASH: time.monotonic()}
+        self._protected_cache_hashes = OrderedDict()
+        self._ancestors = {GENESIS_BLOCK_HASH: [GENESIS_BLOCK.prev_block_hash]}
+        self._cached_children = {GENESIS_BLOCK.prev_block_hash: 1}
         self.unconfirmed_transactions = {}
+        self._unconfirmed_by_input = {}
+        self._unverified_transactions = set()
+        self._tx_verify_cache = {}
 
         # Adding the tx from Genesis block to unspent coins
         for tx in GENESIS_BLOCK.transactions:
@@ -134,21 +290,41 @@ class ChainBuilder:
         protocol.block_request_handlers.append(self.block_request_received)
         self.protocol = protocol
 
+        self._verify_executor = ThreadPoolExecutor(thread_name_prefix="chainbuilder-verify")
         self._thread_id = None
 
-    def _assert_thread_safety(self):
+    def shutdown(self) -> None:
+        """
+        Stops handling events from the protocol and stops the worker threads of this chain builder.
+        It must not be used afterwards.
+        """
+        protocol = self.protocol
+        protocol.block_receive_handlers.remove(self.new_block_received)
+        protocol.trans_receive_handlers.remove(self.new_transaction_received)
+        protocol.block_request_handlers.remove(self.block_request_received)
+        self._verify_executor.shutdown()
+
+    def _on_event_thread(self) -> bool:
+        """
+        Returns whether we run on the thread that handled the first event, so that all event
+        handlers can check that they run on the same thread. Callers use it as
+        `assert self._on_event_thread()`, so the check is compiled out entirely under `python -O`.
+        """
         if self._thread_id is None:
             self._thread_id = threading.get_ident()
-        assert self._thread_id == threading.get_ident()
+        return self._thread_id == threading.get_ident()
 
-    def block_request_received(self, block_hash: bytes) -> 'Optional[Block]':
-        """ Our event handler for block requests in the protocol. """
-        self._assert_thread_safety()
-        return self.block_cache.get(block_hash)
+    def block_request_received(self, block_hash: bytes) -> 'Optional[Union[Block, _ColdBlock]]':
+        """
+        Our event handler for block requests in the protocol. Blocks in compact form are not
+        deserialized, as the protocol only needs their previous block hash and JSON representation.
+        """
+        assert self._on_event_thread()
+        return self._get_cached_block(block_hash)
 
-    def new_transaction_received(self, transaction: 'Transaction'):
+    def new_transaction_received(self, transaction: 'Transaction') -> None:
         """ Event handler that is called by the network layer when a transaction is received. """
-        self._assert_thread_safety()
+        assert self._on_event_thread()
         hash_val = transaction.get_hash()
 
         def input_ok(inp):
@@ -158,22 +334,42 @@ class ChainBuilder:
         if hash_val not in self.unconfirmed_transactions and \
                 all(input_ok(inp) for inp in transaction.inputs):
             self.unconfirmed_transactions[hash_val] = transaction
+            self._unverified_transactions.add(hash_val)
+            for inp in transaction.inputs:
+                self._unconfirmed_by_input.setdefault((inp.transaction_hash, inp.output_idx), set()).add(hash_val)
             self.protocol.broadcast_transaction(transaction)
             for handler in self.transaction_change_handlers:
                 handler()
 
-    def _new_primary_block_chain(self, chain: 'Blockchain'):
+    def _new_primary_block_chain(self, chain: 'Blockchain') -> None:
         """ Does all the housekeeping that needs to be done when a new longest chain is found. """
         logging.info("new chain:  height %d -  target %10.2e", len(chain.blocks),
                      chain.total_difficulty)
-        self._assert_thread_safety()
+        assert self._on_event_thread()
+        old_chain = self.primary_block_chain
         self.primary_block_chain = chain
-        todelete = set()
-        for (hash_val, trans) in self.unconfirmed_transactions.items():
-            if not trans.validate_tx(chain.unspent_coins):
-                todelete.add(hash_val)
-        for hash_val in todelete:
-            del self.unconfirmed_transactions[hash_val]
+
+        # Transactions that were valid on the old chain can only become invalid if one of their
+        # inputs was spent or created by a block that is not part of both chains.
+        fork_idx = self._fork_index(old_chain, chain)
+        affected = self._unverified_transactions
+        unconfirmed_by_input = self._unconfirmed_by_input
+        for coin in self._changed_coins(old_chain, chain, fork_idx):
+            affected.update(unconfirmed_by_input.get(coin, ()))
+        self._unverified_transactions = set()
+
+        demote = self._demote_cached_block
+        add_cache_key = self._add_cache_key
+        for block in old_chain.blocks[fork_idx + 1:]:
+            demote(block.hash)
+            add_cache_key(block.hash)
+        remove_cache_key = self._remove_cache_key
+        for block in chain.blocks[fork_idx + 1:]:
+            remove_cache_key(block.hash)
+
+        remove = self._remove_unconfirmed_transaction
+        for hash_val in self._invalid_unconfirmed_transactions(affected, chain):
+            remove(hash_val)
 
         for handler in self.chain_change_handlers:
             handler()
@@ -183,104 +379,453 @@ class ChainBuilder:
 
         self.protocol.broadcast_primary_block(chain.head)
 
-    def _build_blockchain(self, checkpoint: 'Blockchain', blocks: 'List[Block]'):
-        def checkpoint_hashes(chain):
-            chain_len = len(chain.blocks)
-            idx = 0
-            yield GENESIS_BLOCK_HASH
-            while chain_len > 1:
-                cp = 2 ** (math.floor(math.log(chain_len, 2) - 1))
-                idx += cp
-                yield chain.blocks[idx].hash
-                chain_len = chain_len - cp
-
-        chain = checkpoint
-        checkpoints = self._blockchain_checkpoints.copy()
+    @staticmethod
+    def _fork_index(old_chain: 'Blockchain', new_chain: 'Blockchain') -> int:
+        """ Returns the index of the youngest block that is part of both block chains. """
+        new_indices = new_chain.block_indices
+        fork_idx = min(len(old_chain.blocks), len(new_chain.blocks)) - 1
+        while old_chain.blocks[fork_idx].hash not in new_indices:
+            fork_idx -= 1
+        return fork_idx
+
+    @staticmethod
+    def _changed_coins(old_chain: 'Blockchain', new_chain: 'Blockchain', fork_idx: int) -> 'Set[Tuple[bytes, int]]':
+        """
+        Returns the coins that are spent or created by the blocks that are part of only one of the
+        block chains `old_chain` and `new_chain`, which share their blocks up to `fork_idx`.
+        """
+        coins = set()
+        for block in old_chain.blocks[fork_idx + 1:] + new_chain.blocks[fork_idx + 1:]:
+            for t in block.transactions:
+                coins.update((inp.transaction_hash, inp.output_idx) for inp in t.inputs)
+                coins.update((t.get_hash(), i) for i in range(len(t.targets)))
+        return coins
+
+    def _invalid_unconfirmed_transactions(self, hashes: 'Set[bytes]', chain: 'Blockchain') -> 'List[bytes]':
+        """
+        Verifies the unconfirmed transactions `hashes` on top of `chain` and returns the hashes of
+        the invalid ones. Results of earlier verifications on the same block chain head are reused,
+        the remaining transactions are verified concurrently, as checking their signatures happens
+        mostly outside of the GIL.
+        """
+        results = self._tx_verify_cache.setdefault(chain.head.hash, {})
+        invalid = [hash_val for hash_val in hashes if hash_val in results and not results[hash_val]]
+        unknown = [hash_val for hash_val in hashes if hash_val not in results]
+        transactions = [self.unconfirmed_transactions[hash_val] for hash_val in unknown]
+        unspent_coins = chain.unspent_coins
+        if len(transactions) > 1:
+            valid = self._verify_executor.map(lambda trans: trans.validate_tx(unspent_coins), transactions)
+        else:
+            valid = [trans.validate_tx(unspent_coins) for trans in transactions]
+
+        for hash_val, is_valid in zip(unknown, valid):
+            if not is_valid:
+                invalid.append(hash_val)
+            if len(results) < TX_VERIFY_CACHE_SIZE:
+                results[hash_val] = is_valid
+        return invalid
+
+    def _remove_unconfirmed_transaction(self, hash_val: bytes) -> None:
+        """ Removes the transaction `hash_val` from the unconfirmed transactions. """
+        trans = self.unconfirmed_transactions.pop(hash_val)
+        for inp in trans.inputs:
+            coin = (inp.transaction_hash, inp.output_idx)
+            spending = self._unconfirmed_by_input[coin]
+            spending.discard(hash_val)
+            if not spending:
+                del self._unconfirmed_by_input[coin]
+
+    @staticmethod
+    def _verify_partial_chain(checkpoint: 'Blockchain', blocks: 'Iterable[Block]') -> 'Tuple[List[Blockchain], bool]':
+        """
+        Appends `blocks` to `checkpoint`, one after another. Returns the block chains after each
+        successfully appended block (starting with `checkpoint`) and whether all blocks were valid.
+
+        This does not access the state of the chain builder, so it can run in a worker thread.
+        """
+        chains = [checkpoint]
         for b in blocks:
-            next_chain = chain.try_append(b)
+            next_chain = chains[-1].try_append(b)
             if next_chain is None:
-                logging.warning("invalid block")
-                for handler in self.chain_change_handlers:
-                    handler() # this is a hot fix! that keeps the miner mining
+                return chains, False
+            chains.append(next_chain)
+        return chains, True
+
+    def _verify_partial_chains(self, checkpoint: 'Blockchain', blocks: 'List[Deque[Block]]') \
+            -> 'Iterable[Tuple[List[Blockchain], bool]]':
+        """
+        Verifies the competing partial chains `blocks` on top of `checkpoint`, like
+        `_verify_partial_chain`. Competing chains usually only fork near their tips, so the blocks
+        they all share are verified just once, and only the remaining blocks of each chain are
+        verified concurrently.
+        """
+        if len(blocks) == 1:
+            return [self._verify_partial_chain(checkpoint, blocks[0])]
+
+        prefix_len = 0
+        for prefix_blocks in zip(*blocks):
+            first_hash = prefix_blocks[0].hash
+            if any(b.hash != first_hash for b in prefix_blocks):
                 break
+            prefix_len += 1
+
+        prefix_chains, valid = self._verify_partial_chain(checkpoint, islice(blocks[0], prefix_len))
+        if not valid:
+            # all chains contain the same invalid block
+            return [(prefix_chains, False)]
 
-            chain = next_chain
-            checkpoints[chain.head.hash] = chain
+        suffixes = [islice(chain_blocks, prefix_len, None) for chain_blocks in blocks]
+        results = self._verify_executor.map(self._verify_partial_chain, repeat(prefix_chains[-1]), suffixes)
+        return [(prefix_chains[:-1] + chains, valid) for chains, valid in results]
 
+    def _build_blockchain(self, chains: 'List[Blockchain]') -> None:
+        """
+        Makes the last of the block chains `chains` returned by `_verify_partial_chain` the new
+        primary block chain, if it is longer than the current one.
+        """
+        chain = chains[-1]
         if chain.total_difficulty < self.primary_block_chain.total_difficulty:
             logging.warning("discarding shorter chain")
             return
 
-        for hash_val in checkpoints.keys() - set(checkpoint_hashes(next_chain)):
+        checkpoints = self._blockchain_checkpoints.copy()
+        for c in chains[1:]:
+            checkpoints[c.head.hash] = c
+        for hash_val in checkpoints.keys() - chain.checkpoint_hashes:
             del checkpoints[hash_val]
         self._blockchain_checkpoints = checkpoints
+        for head_hash in self._tx_verify_cache.keys() - checkpoints.keys():
+            del self._tx_verify_cache[head_hash]
         self._new_primary_block_chain(chain)
 
-    def _retry_expired_requests(self):
+    def _retry_expired_requests(self) -> None:
         """ Sends new block requests to our peers for unanswered pending requests. """
-        for request in self._block_requests.values():
-            request.checked_retry(self.protocol)
+        primary_height = self.primary_block_chain.head.height
+        now = time.monotonic()
+        block_requests = self._block_requests
+        heap = self._requests_by_deadline
+        while heap and heap[0][0] < now:
+            _, _, block_hash, request = heapq.heappop(heap)
+            if block_requests.get(block_hash) is not request:
+                continue
+            request.checked_retry(self.protocol, primary_height, now)
+            self._schedule_retry(request)
 
-    def _clean_block_requests(self):
+    def _schedule_retry(self, request: 'BlockRequest') -> None:
+        """ Remembers when to retry `request` next, or that it timed out. """
+        if request.timeout_reached():
+            self._timed_out_requests.append(request.block_hash)
+        else:
+            heapq.heappush(self._requests_by_deadline,
+                           (request.retry_deadline(), id(request), request.block_hash, request))
+
+    def _clean_block_requests(self) -> None:
         """
         Deletes partial chains and block requests when they are shorter than the primary block
         chain or all download attempts failed.
         """
         # TODO: call this regularly when not mining
-        block_requests = {}
-        for block_hash, request in self._block_requests.items():
-            if request.timeout_reached():
-                logging.info("giving up on a block")
+        head_height = self.primary_block_chain.head.height
+        block_requests = self._block_requests
+        heap = self._partial_chains_by_height
+        heappop = heapq.heappop
+        demote_partial_chain = self._demote_partial_chain
+        while heap and heap[0][0] <= head_height:
+            _, _, block_hash, partial_chain = heappop(heap)
+            request = block_requests.get(block_hash)
+            if request is None:
                 continue
+            partial_chains = request.partial_chains
+            if not any(pc is partial_chain for pc in partial_chains):
+                continue
+            partial_chains.remove(partial_chain)
+            demote_partial_chain(partial_chain, block_hash)
+            if not partial_chains:
+                del block_requests[block_hash]
+
+        for block_hash in self._timed_out_requests:
+            request = block_requests.get(block_hash)
+            if request is not None and request.timeout_reached():
+                logging.info("giving up on a block")
+                for partial_chain in request.partial_chains:
+                    demote_partial_chain(partial_chain, block_hash)
+                del block_requests[block_hash]
+        self._timed_out_requests = []
 
-            new_requests = []
+    def _demote_cached_block(self, block_hash: bytes) -> None:
+        """
+        Replaces the block `block_hash` in the block cache by its compact form, unless it is part
+        of the primary block chain.
+        """
+        block = self.block_cache.get(block_hash)
+        if isinstance(block, Block) and block_hash not in self.primary_block_chain.block_indices:
+            self.block_cache[block_hash] = _ColdBlock.from_block(block)
+
+    def _demote_partial_chain(self, partial_chain: 'Block', block_hash: bytes) -> None:
+        """ Demotes the cached blocks of a partial chain that waits for the block `block_hash`. """
+        cache = self.block_cache
+        primary_indices = self.primary_block_chain.block_indices
+        cur_hash = partial_chain.hash
+        while cur_hash != block_hash:
+            block = cache.get(cur_hash)
+            if block is None:
+                break
+            if isinstance(block, Block) and cur_hash not in primary_indices:
+                cache[cur_hash] = _ColdBlock.from_block(block)
+            cur_hash = block.prev_block_hash
+
+    def _get_cached_block(self, block_hash: bytes) -> 'Optional[Union[Block, _ColdBlock]]':
+        """ Looks up the block `block_hash` in the block cache and marks it as recently used. """
+        block = self.block_cache.get(block_hash)
+        if block is not None:
+            self._cache_last_used[block_hash] = time.monotonic()
+        return block
+
+    def _protect_cached_block(self, block_hash: bytes) -> None:
+        """ Protects the cached block `block_hash` from eviction, as long as it stays recently used. """
+        protected = self._protected_cache_hashes
+        protected[block_hash] = None
+        protected.move_to_end(block_hash)
+        if len(protected) > BLOCK_CACHE_PROTECTED_SIZE:
+            protected.popitem(last=False)
+
+    def _pinned_cache_hashes(self) -> 'Set[bytes]':
+        """ Returns the hashes of the cached blocks of all partial chains waiting for a block request. """
+        cache = self.block_cache
+        primary_indices = self.primary_block_chain.block_indices
+        pinned = set()
+        for request in self._block_requests.values():
             for partial_chain in request.partial_chains:
-                if partial_chain[0].height > self.primary_block_chain.head.height:
-                    new_requests.append(partial_chain)
-            if new_requests:
-                request.partial_chains = new_requests
-                block_requests[block_hash] = request
-        self._block_requests = block_requests
-
-    def new_block_received(self, block: 'Block'):
-        """ Event handler that is called by the network layer when a block is received. """
-        self._assert_thread_safety()
-        bl_hash = block.hash
+                cur_hash = partial_chain.hash
+                while cur_hash not in pinned and cur_hash not in primary_indices:
+                    block = cache.get(cur_hash)
+                    if block is None:
+                        break
+                    pinned.add(cur_hash)
+                    cur_hash = block.prev_block_hash
+        return pinned
+
+    def _evict_cached_blocks(self) -> None:
+        """
+        Evicts blocks from the block cache when there is no room for one more block, skipping blocks
+        of the primary block chain and of partial chains as well as blocks with cached children.
+        Each victim is the less recently used one of two randomly sampled blocks.
 
-        if (bl_hash in self.block_cache) or (not block.verify_difficulty()) or (not block.verify_merkle()):
+        Finding the blocks of partial chains takes time linear in their length, so a batch of
+        `BLOCK_CACHE_EVICTION_BATCH` additional blocks is evicted at once to amortize this.
+        """
+        keys = self._cache_keys
+        excess = len(keys) + 1 - BLOCK_CACHE_SIZE
+        if excess <= 0:
+            return
+        excess = min(excess + BLOCK_CACHE_EVICTION_BATCH, len(keys))
+        primary_indices = self.primary_block_chain.block_indices
+        pinned = self._pinned_cache_hashes()
+        last_used = self._cache_last_used
+        children = self._cached_children
+        protected = self._protected_cache_hashes
+
+        # bounded, as (almost) all cached blocks might be pinned
+        for _ in range(len(keys)):
+            candidates = [h for h in (random.choice(keys), random.choice(keys))
+                          if h not in pinned and not children.get(h)]
+            if not candidates:
+                continue
+            # evicting a block can turn its predecessor into a candidate, which is then evicted as well
+            block_hash = min(candidates, key=lambda h: (h in protected, last_used[h]))
+            while True:
+                prev_hash = self.block_cache[block_hash].prev_block_hash
+                self._remove_from_cache(block_hash)
+                excess -= 1
+                if excess <= 0:
+                    return
+                if prev_hash not in last_used or prev_hash in primary_indices or prev_hash in pinned or \
+                        children.get(prev_hash):
+                    break
+                block_hash = prev_hash
+
+    def _add_cache_key(self, block_hash: bytes) -> None:
+        """ Makes the cached block `block_hash` a candidate for eviction again. """
+        if block_hash in self.block_cache and block_hash not in self._cache_key_indices:
+            self._cache_key_indices[block_hash] = len(self._cache_keys)
+            self._cache_keys.append(block_hash)
+
+    def _remove_cache_key(self, block_hash: bytes) -> None:
+        """ Stops sampling the block `block_hash` as a candidate for eviction. """
+        keys = self._cache_keys
+        idx = self._cache_key_indices.pop(block_hash, None)
+        if idx is None:
             return
-        self.block_cache[bl_hash] = block
+        last_key = keys.pop()
+        if last_key != block_hash:
+            keys[idx] = last_key
+            self._cache_key_indices[last_key] = idx
+
+    def _remove_from_cache(self, block_hash: bytes) -> None:
+        """ Removes the block `block_hash` and its bookkeeping from the block cache. """
+        self._remove_cache_key(block_hash)
+        prev_hash = self.block_cache.pop(block_hash).prev_block_hash
+        del self._cache_last_used[block_hash]
+        self._protected_cache_hashes.pop(block_hash, None)
+        del self._ancestors[block_hash]
+        self._cached_children.pop(block_hash, None)
+        self._cached_children[prev_hash] -= 1
+        if not self._cached_children[prev_hash]:
+            del self._cached_children[prev_hash]
+
+    def _extend_ancestors(self, block_hash: bytes) -> 'List[bytes]':
+        """
+        Extends the ancestor pointers of the cached block `block_hash` as far as the ancestor
+        pointers of its ancestors allow, and returns them.
+        """
+        all_ancestors = self._ancestors
+        ancestors = all_ancestors[block_hash]
+        while True:
+            k = len(ancestors) - 1
+            prev_ancestors = all_ancestors.get(ancestors[k])
+            if prev_ancestors is None or len(prev_ancestors) <= k:
+                return ancestors
+            ancestors.append(prev_ancestors[k])
+
+    def _add_to_cache(self, block: 'Block') -> None:
+        """ Adds `block` to the block cache and computes its ancestor pointers. """
+        # counting the child first keeps its predecessor from being evicted to make room for it
+        prev_hash = block.prev_block_hash
+        self._cached_children[prev_hash] = self._cached_children.get(prev_hash, 0) + 1
+        self._evict_cached_blocks()
+        self.block_cache[block.hash] = block
+        self._add_cache_key(block.hash)
+        self._cache_last_used[block.hash] = time.monotonic()
+
+        self._ancestors[block.hash] = [prev_hash]
+        self._extend_ancestors(block.hash)
+
+    def _partial_chain_start(self, block: 'Block') -> 'Block':
+        """
+        Finds the oldest block of the partial chain ending with `block`, i.e. the first block
+        (following the previous block pointers) whose predecessor is not in the block cache or is
+        the head of a checkpoint.
+        """
+        cache = self.block_cache
+        extend_ancestors = self._extend_ancestors
+        primary_indices = self.primary_block_chain.block_indices
+
+        # Jump over blocks that are not part of the primary block chain. As these cannot be
+        # checkpoints, we only need to make sure that all skipped blocks are in the block cache,
+        # which is the case when the `2**k`-th ancestor is known.
+        block_hash = block.hash
+        while True:
+            for ancestor in reversed(extend_ancestors(block_hash)):
+                if ancestor in cache and ancestor not in primary_indices:
+                    block_hash = ancestor
+                    break
+            else:
+                break
+        block = self._get_cached_block(block_hash)
 
-        self._retry_expired_requests()
+        prev_hash = block.prev_block_hash
+        if prev_hash not in cache or prev_hash in self._blockchain_checkpoints:
+            return block
 
-        if bl_hash not in self._block_requests:
-            self._block_requests[bl_hash] = BlockRequest()
-        else:
+        # The remaining blocks are all part of the primary block chain, so we can continue directly
+        # at the youngest checkpoint that is older than the predecessor.
+        prev_idx = primary_indices[prev_hash]
+        checkpoint_idx = max(idx for idx in (primary_indices[h] for h in self._blockchain_checkpoints)
+                             if idx < prev_idx)
+        return self.primary_block_chain.blocks[checkpoint_idx + 1]
+
+    def _partial_chain_blocks(self, partial_chain: 'Block', block_hash: bytes) -> 'Deque[Block]':
+        """
+        Returns the blocks of the partial chain ending with `partial_chain` that follow the block
+        `block_hash`, oldest first.
+        """
+        cache = self.block_cache
+        blocks = deque([partial_chain])
+        prev_hash = partial_chain.prev_block_hash
+        while prev_hash != block_hash:
+            block = self._get_cached_block(prev_hash)
+            if isinstance(block, _ColdBlock):
+                # the block was demoted before, so it is used again
+                block = block.to_block()
+                cache[prev_hash] = block
+                self._protect_cached_block(prev_hash)
+            blocks.appendleft(block)
+            prev_hash = block.prev_block_hash
+        return blocks
+
+    def new_block_received(self, block: 'Block') -> None:
+        """ Event handler that is called by the network layer when a block is received. """
+        assert self._on_event_thread()
+        bl_hash = block.hash
+
+        if bl_hash in self.block_cache or not block.verify_difficulty() or not block.verify_merkle():
             return
+        self._add_verified_block(block, bl_hash in self._block_requests)
 
-        request = self._block_requests[bl_hash]
-        del self._block_requests[bl_hash]
+    @staticmethod
+    def _extend_partial_chains(request: 'BlockRequest', block: 'Block', tips: 'List[Block]') -> 'List[Block]':
+        """
+        Adds the partial chains `tips`, which all contain `block`, to the partial chains waiting for
+        `request` and returns them. A partial chain ending with the predecessor of `block` is
+        replaced, as it is part of all of them. Otherwise, the blocks of a batch, which arrive
+        oldest first, would each be kept as a partial chain and verified separately.
+        """
+        partial_chains = request.partial_chains
+        prev_hash = block.prev_block_hash
+        partial_chains[:] = [pc for pc in partial_chains if pc.hash != prev_hash]
+        partial_chains.extend(tips)
+        return partial_chains
 
-        while True:
-            for partial_chain in request.partial_chains:
-                partial_chain.append(block)
-            if (block.prev_block_hash not in self.block_cache) or (
-                    block.prev_block_hash in self._blockchain_checkpoints):
-                break
-            block = self.block_cache[block.prev_block_hash]
+    def _add_verified_block(self, block: 'Block', requested: bool) -> None:
+        """
+        Adds the block `block`, whose hashes were verified, to the block cache and tries to build a
+        new primary block chain with it. If some partial chains were waiting for `block`, they are
+        extended by it instead.
+        """
+        self._add_to_cache(block)
 
-        if block.prev_block_hash in self._block_requests:
-            chains = request.partial_chains
-            request = self._block_requests[block.prev_block_hash]
-            request.partial_chains.extend(chains)
-        else:
-            request.clear()
-            self._block_requests[block.prev_block_hash] = request
+        self._retry_expired_requests()
 
-        if block.prev_block_hash in self._blockchain_checkpoints:
-            del self._block_requests[block.prev_block_hash]
-            checkpoint = self._blockchain_checkpoints[block.prev_block_hash]
-            for partial_chain in request.partial_chains:
-                self._build_blockchain(checkpoint, partial_chain[::-1])
-        request.checked_retry(self.protocol)
+        if requested:
+            fulfilled = self._block_requests.pop(block.hash)
+            tips = fulfilled.partial_chains
+        else:
+            fulfilled = None
+            tips = [block]
+
+        start = self._partial_chain_start(block)
+        prev_hash = start.prev_block_hash
+
+        if prev_hash in self._blockchain_checkpoints:
+            checkpoint = self._blockchain_checkpoints[prev_hash]
+            request = self._block_requests.pop(prev_hash, None)
+            chains = tips if request is None else self._extend_partial_chains(request, block, tips)
+            blocks = [self._partial_chain_blocks(partial_chain, prev_hash) for partial_chain in chains]
+            results = self._verify_partial_chains(checkpoint, blocks)
+            # only the longest of the competing chains can become the new primary block chain
+            best_chains = None
+            for verified_chains, valid in results:
+                if not valid:
+                    logging.warning("invalid block")
+                    for handler in self.chain_change_handlers:
+                        handler() # this is a hot fix! that keeps the miner mining
+                if best_chains is None or \
+                        verified_chains[-1].total_difficulty >= best_chains[-1].total_difficulty:
+                    best_chains = verified_chains
+            self._build_blockchain(best_chains)
+            return
 
+        request = self._block_requests.get(prev_hash)
+        new_request = request is None
+        if new_request:
+            request = BlockRequest(prev_hash, start.height - 1)
+            self._block_requests[prev_hash] = request
+        self._extend_partial_chains(request, block, tips)
+        for tip in tips:
+            heapq.heappush(self._partial_chains_by_height, (tip.height, id(tip), prev_hash, tip))
+        if new_request:
+            now = time.monotonic()
+            if fulfilled is not None:
+                request.continue_request(fulfilled, now)
+            request.checked_retry(self.protocol, self.primary_block_chain.head.height, now)
+            self._schedule_retry(request)
@@ -6,10 +6,33 @@ GENESIS_REWARD = 1000
 REWARD_HALF_LIFE = 10000
 """ The number of blocks until the block reward is halved. """
 
-BLOCK_REQUEST_RETRY_INTERVAL = timedelta(seconds=30)
-""" The approximate interval after which a block request will be retried. """
+BLOCK_REQUEST_RETRY_INTERVAL = 5.0
+""" The approximate interval (in seconds) after which a block request will be retried for the first time. """
+BLOCK_REQUEST_MAX_RETRY_INTERVAL = 60.0
+""" The retry interval is doubled after every attempt, up to this interval (in seconds). """
 BLOCK_REQUEST_RETRY_COUNT = 3
 """ The number of failed requests of a block until we give up and delete the depending partial chains. """
+MAX_BLOCKS_PER_REQUEST = 256
+""" The maximum number of blocks that are requested from (and sent to) a peer at once. """
+SIGNATURE_CACHE_SIZE = 65536
+""" The maximum number of remembered signature verification results. """
+KEY_CACHE_SIZE = 4096
+""" The maximum number of remembered parsed public and private keys. """
+TX_VERIFY_CACHE_SIZE = 16384
+""" The maximum number of remembered transaction verification results per block chain head. """
+BLOCK_CACHE_SIZE = 4096
+"""
+The number of blocks in the block cache that are not part of the primary block chain above which
+blocks are evicted. Blocks of the primary block chain and of partial chains waiting for a block
+request are never evicted.
+"""
+BLOCK_CACHE_PROTECTED_SIZE = 1024
+"""
+The maximum number of blocks in the block cache that are protected from eviction because a partial
+chain used them again after they were demoted. With `0`, all blocks are treated the same.
+"""
+BLOCK_CACHE_EVICTION_BATCH = 256
+""" The number of blocks that are evicted from the block cache in addition to the one that is needed. """
 
 GENESIS_TARGET = (1 << 256) - 1
 """
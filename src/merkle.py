@@ -8,7 +8,7 @@ from treelib import Node, Tree
 
 from .crypto import get_hasher
 
-__all__ = ['merkle_tree', 'MerkleNode']
+__all__ = ['merkle_tree', 'merkle_root_hash', 'MerkleNode']
 
 class MerkleNode:
     """
@@ -66,3 +66,26 @@ def merkle_tree(values: list) -> MerkleNode:
         values = nodes
 
     return values[0]
+
+def merkle_root_hash(values: list) -> bytes:
+    """
+    Computes the root hash of the Merkle tree `merkle_tree(values)` would construct.
+
+    Instead of building the tree, this hashes the concatenated sibling hashes one level at a time,
+    which avoids creating a `MerkleNode` per inner node when only the root hash is needed.
+    """
+
+    if not values:
+        return get_hasher().digest()
+
+    hashes = [v.get_hash() for v in values]
+    empty = get_hasher()
+    while len(hashes) > 1:
+        next_level = []
+        for i in range(0, len(hashes), 2):
+            hasher = empty.copy()
+            hasher.update(b''.join(hashes[i:i + 2]))
+            next_level.append(hasher.digest())
+        hashes = next_level
+
+    return hashes[0]
@@ -90,8 +90,8 @@ class Miner:
     will happen automatically, with the mined block switching every time the chainbuilder finds a
     new primary block chain.
 
-    To stop the mining process, there is the `shutdown` method. Once stopped, mining cannot be
-    resumed (except by creating a new `Miner`).
+    To stop the mining process, there is the `shutdown` method, which also shuts down the chain
+    builder. Once stopped, mining cannot be resumed (except by creating a new `Miner`).
 
     :ivar proto: The protocol where newly mined blocks will be sent to.
     :vartype proto: Protocol
@@ -187,3 +187,4 @@ class Miner:
             self._stop_mining_for_now()
             self._miner_cond.notify()
         self.chainbuilder.chain_change_handlers.remove(self._chain_changed)
+        self.chainbuilder.shutdown()
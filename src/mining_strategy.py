@@ -30,10 +30,14 @@ def create_block(blockchain: 'Blockchain', unconfirmed_transactions: 'List[Trans
     sorted_unconfirmed_tx = sorted(unconfirmed_transactions,
                                    key=lambda tx: tx.get_transaction_fee(blockchain.unspent_coins), reverse=True)
 
+    # the coins spent by the transactions in `transactions`, to find double spends in O(1)
+    spent_coins = set()
     transactions = []
     for t in sorted_unconfirmed_tx:
-        if t.validate_tx(blockchain.unspent_coins) and not t.check_tx_collision(transactions):
+        coins = [(inp.transaction_hash, inp.output_idx) for inp in t.inputs]
+        if spent_coins.isdisjoint(coins) and t.validate_tx(blockchain.unspent_coins):
             transactions.append(t)
+            spent_coins.update(coins)
 
     reward = compute_blockreward_next_block(blockchain.head.height)
     fees = sum(t.get_transaction_fee(blockchain.unspent_coins) for t in transactions)
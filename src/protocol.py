@@ -13,6 +13,10 @@ payload.
 To make sure that the peer acting as a TCP server in a connection knows how to reach the TCP client,
 there is a 'myport' message containing the TCP port where a peer listens for incoming connections.
 
+Each peer also sends an 'id' message with a random connection id and the optional message types it
+understands (see `FEATURES`), so that these are only sent to peers that can handle them. Older
+versions of the program send just the connection id and never get any optional messages.
+
 For other message types, you can look at the `received_*` methods of `Protocol`.
 """
 
@@ -28,6 +32,7 @@ from uuid import uuid4
 from typing import Callable, List, Optional
 
 from .blockchain import GENESIS_BLOCK_HASH
+from .config import MAX_BLOCKS_PER_REQUEST
 
 __all__ = ['Protocol', 'PeerConnection', 'MAX_PEERS', 'HELLO_MSG']
 
@@ -44,6 +49,12 @@ succeed.
 SOCKET_TIMEOUT = 30
 """ The socket timeout for P2P connections. """
 
+FEATURES = ["getblocks"]
+"""
+The optional message types we understand. Peers that do not announce a message type in their 'id'
+message close the connection when they receive it.
+"""
+
 
 class PeerConnection:
     """
@@ -57,6 +68,7 @@ class PeerConnection:
     :ivar proto: The Protocol instance this peer connection belongs to.
     :ivar is_connected: A boolean indicating the current connection status.
     :ivar outgoing_msgs: A queue of messages we want to send to this peer.
+    :ivar features: The optional message types this peer announced to understand.
     """
 
     def __init__(self, peer_addr: tuple, proto: 'Protocol', sock: socket.socket = None):
@@ -67,6 +79,7 @@ class PeerConnection:
         self.is_connected = False
         self._sent_uuid = str(uuid4())
         self.outgoing_msgs = Queue()
+        self.features = frozenset()
         self._close_lock = Lock()
 
         Thread(target=self.run, daemon=True).start()
@@ -102,8 +115,9 @@ class PeerConnection:
         self.is_connected = True
 
         self.send_msg("myport", self.proto.server.server_address[1])
+        # before the block, so that the peer knows our features when it requests its predecessors
+        self.send_msg("id", {"uuid": self._sent_uuid, "features": FEATURES})
         self.send_msg("block", self.proto._primary_block)
-        self.send_msg("id", self._sent_uuid)
         self.send_peers()
 
         Thread(target=self.reader_thread, daemon=True).start()
@@ -225,6 +239,8 @@ class Protocol:
     :ivar trans_receive_handlers: Event handlers that get called when a new transaction is received.
     :vartype trans_receive_handlers: List[Callable]
     :ivar block_request_handlers: Event handlers that get called when a block request is received.
+                                  They return the block, or any object with its `prev_block_hash`
+                                  and `to_json_compatible()`, or None.
     :vartype block_request_handlers: List[Callable]
     :ivar peers: The peers we are connected to.
     :vartype peers: List[PeerConnection]
@@ -286,7 +302,8 @@ class Protocol:
             logging.debug("not broadcasting block again")
             return
 
-        logging.debug("* > block %s", hexlify(block.hash))
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug("* > block %s", hexlify(block.hash))
         self._primary_block = obj
 
         for peer in self.peers:
@@ -295,7 +312,8 @@ class Protocol:
 
     def broadcast_transaction(self, trans: 'Transaction'):
         """ Notifies all peers and local listeners of a new transaction. """
-        logging.debug("* > transaction %s", hexlify(trans.get_hash()))
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug("* > transaction %s", hexlify(trans.get_hash()))
         for peer in self.peers:
             peer.send_msg("transaction", trans.to_json_compatible())
 
@@ -332,14 +350,20 @@ class Protocol:
                 except OSError:
                     pass
 
-    def received_id(self, uuid: str, sender: PeerConnection):
+    def received_id(self, param, sender: PeerConnection):
         """
-        A unique connection id was received. We use this to detect and close connections to
-        ourselves.
+        A unique connection id was received, usually along with the optional message types the peer
+        understands. We use the id to detect and close connections to ourselves.
 
         TODO: detect duplicate connections to other peers (needs TLS or something similar)
         """
-        logging.debug("%s < id %s", sender.peer_addr, uuid)
+        if isinstance(param, str):
+            # older versions only send the id
+            uuid, features = param, []
+        else:
+            uuid, features = param["uuid"], param["features"]
+        logging.debug("%s < id %s %s", sender.peer_addr, uuid, features)
+        sender.features = frozenset(features)
         for peer in self.peers:
             if peer._sent_uuid == uuid:
                 peer.close()
@@ -375,26 +399,50 @@ class Protocol:
                     logging.debug("%s > peer %s", peer.peer_addr, sender.peer_addr)
                     peer.send_msg("peer", list(sender.peer_addr))
 
+    def _find_requested_block(self, block_hash: bytes) -> 'Optional[Block]':
+        """ Asks the block request handlers for the block with hash `block_hash`. """
+        for handler in self.block_request_handlers:
+            block = handler(block_hash)
+            if block is not None:
+                return block
+        return None
+
     def received_getblock(self, block_hash: str, peer: PeerConnection):
         """ We received a request for a new block from a certain peer. """
         logging.debug("%s < getblock %s", peer.peer_addr, block_hash)
-        for handler in self.block_request_handlers:
-            block = handler(unhexlify(block_hash))
-            if block is not None:
-                peer.send_msg("block", block.to_json_compatible())
+        block = self._find_requested_block(unhexlify(block_hash))
+        if block is not None:
+            peer.send_msg("block", block.to_json_compatible())
+
+    def received_getblocks(self, request: list, peer: PeerConnection):
+        """
+        We received a request for a block and up to `count - 1` of its predecessors from a certain
+        peer. The blocks are sent newest first: each of them is the one the peer waits for next, so
+        that the peer builds its new primary block chain only once, when the oldest block arrives.
+        """
+        block_hash, count = request
+        logging.debug("%s < getblocks %s %s", peer.peer_addr, block_hash, count)
+        block_hash = unhexlify(block_hash)
+        for _ in range(min(int(count), MAX_BLOCKS_PER_REQUEST)):
+            block = self._find_requested_block(block_hash)
+            if block is None:
                 break
+            peer.send_msg("block", block.to_json_compatible())
+            block_hash = block.prev_block_hash
 
     def received_block(self, block: dict, sender: PeerConnection):
         """ Someone sent us a block. """
         block = Block.from_json_compatible(block)
-        logging.debug("%s < block %s", sender.peer_addr, hexlify(block.hash))
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug("%s < block %s", sender.peer_addr, hexlify(block.hash))
         for handler in self.block_receive_handlers:
             handler(block)
 
     def received_transaction(self, transaction: dict, sender: PeerConnection):
         """ Someone sent us a transaction. """
         tx = Transaction.from_json_compatible(transaction)
-        logging.debug("%s < transaction %s", sender.peer_addr, hexlify(tx.get_hash()))
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug("%s < transaction %s", sender.peer_addr, hexlify(tx.get_hash()))
         for handler in self.trans_receive_handlers:
             handler(tx)
 
@@ -408,11 +456,18 @@ class Protocol:
         if not peer.is_connected:
             self.peers.remove(peer)
 
-    def send_block_request(self, block_hash: bytes):
-        """ Sends a request for a block to all our peers. """
-        logging.debug("* > getblock %s", hexlify(block_hash))
+    def send_block_request(self, block_hash: bytes, count: int = 1):
+        """
+        Sends a request for a block to all our peers. If `count` is larger than one, the peers that
+        understand 'getblocks' are also asked for up to `count - 1` predecessors of that block.
+        """
+        block_hash = hexlify(block_hash).decode()
+        logging.debug("* > block request %s %d", block_hash, count)
         for peer in self.peers:
-            peer.send_msg("getblock", hexlify(block_hash).decode())
+            if count > 1 and "getblocks" in peer.features:
+                peer.send_msg("getblocks", [block_hash, count])
+            else:
+                peer.send_msg("getblock", block_hash)
 
 
 from .block import Block
@@ -1,9 +1,21 @@
 #! /usr/bin/env/python3
 import hashlib
 import logging
+import time
+from functools import lru_cache
+from .config import SIGNATURE_CACHE_SIZE
 from .crypto import *
-from binascii import hexlify, unhexlify
-from datetime import datetime
+
+
+@lru_cache(maxsize=SIGNATURE_CACHE_SIZE)
+def _verify_signature(pubkey: str, tx_hash: bytes, sig: str) -> bool:
+    """
+    Verifies the hex encoded signature `sig` of `tx_hash` by the JSON encoded public key `pubkey`.
+
+    The results are cached, as the same signatures are checked over and over again: when a
+    transaction is received, when it is mined, and for every (partial) block chain containing it.
+    """
+    return Key.from_json_compatible(pubkey).verify_sign(tx_hash, bytes.fromhex(sig))
 
     
 class ScriptInterpreter:
@@ -38,13 +50,6 @@ class ScriptInterpreter:
             OP_CHECKLOCKTIME
 
     """
-    operations = {
-        'OP_SHA256',
-        'OP_CHECKSIG',
-        'OP_RETURN',
-        'OP_CHECKLOCKTIME'
-    }
-
     def __init__(self, input_script: str, output_script: str, tx_hash: bytes):
         self.output_script = output_script
         self.input_script = input_script
@@ -65,10 +70,7 @@ class ScriptInterpreter:
             logging.warning("Stack is empty")
             return False
 
-        sha256 = hashlib.sha256()
-        sha256.update(str(self.stack.pop()).encode('utf-8'))
-        sha256 = hexlify(sha256.digest())
-        self.stack.append(sha256.decode('utf-8'))
+        self.stack.append(hashlib.sha256(str(self.stack.pop()).encode('utf-8')).hexdigest())
         return True
 
  
@@ -82,11 +84,11 @@ class ScriptInterpreter:
             self.stack.append(str(0))
             return False
 
-        pubKey = Key.from_json_compatible(self.stack.pop())
+        pubKey = self.stack.pop()
 
-        sig = unhexlify(self.stack.pop())
+        sig = self.stack.pop()
 
-        if pubKey.verify_sign(self.tx_hash, sig):
+        if _verify_signature(pubKey, self.tx_hash, sig):
             self.stack.append(str(1))
             return True
 
@@ -119,17 +121,11 @@ class ScriptInterpreter:
             error = 1
 
         #if top stack item is greater than the transactions nLockTime field ERROR
-        temp = float(self.stack.pop())
-        try:
-            timestamp = datetime.fromtimestamp(temp)
-        except TypeError:
-            logging.error("A timestamp needs to be supplied after the OP_CHECKLOCKTIME operation!")
-            self.stack.append(str(0))
-            return False
-
-        #TODO we need to make sure that the timezones are being taken care of
-        if(timestamp > datetime.utcnow()):
-            print("You need to wait at least " + str(timestamp - datetime.utcnow()) + " to spend this Tx")
+        #the lock time is a POSIX timestamp, so it can be compared to the current time directly
+        locktime = float(self.stack.pop())
+        now = time.time()
+        if(locktime > now):
+            logging.info("You need to wait at least %.0f seconds to spend this Tx", locktime - now)
             error = 3
 
         if(error):
@@ -159,17 +155,17 @@ class ScriptInterpreter:
             Run the script with the input and output scripts
         """
         script = self.input_script.split() + self.output_script.split()
+        push = self.stack.append
+        operations = ScriptInterpreter.operations
 
-        while script:
-
-            next_item = script.pop(0) # Fetch next item (start reading from beginning of script)
+        for next_item in script: # read the script from the beginning
 
             # Check if item is data or opcode. If data, push onto stack.
-            if (next_item not in ScriptInterpreter.operations):
-                self.stack.append(next_item)  # if it's data we add it to the stack
+            op = operations.get(next_item)  # Proper operation to be executed
+            if op is None:
+                push(next_item)  # if it's data we add it to the stack
             else:
-                op = getattr(self, next_item.lower())  # Proper operation to be executed
-                op()  # execute the command!
+                op(self)  # execute the command!
 
 
         if (len(self.stack)==1 and self.stack[-1] == '1'):
@@ -178,3 +174,10 @@ class ScriptInterpreter:
             logging.warning("[!] Error: Invalid Tx.")
             return False
 
+    # maps the opcodes to their implementations
+    operations = {
+        'OP_SHA256': op_sha256,
+        'OP_CHECKSIG': op_checksig,
+        'OP_RETURN': op_return,
+        'OP_CHECKLOCKTIME': op_checklocktime
+    }
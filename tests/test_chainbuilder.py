@@ -0,0 +1,149 @@
+from datetime import timedelta
+
+import src.chainbuilder
+from src.block import Block
+from src.blockchain import Blockchain
+from src.chainbuilder import ChainBuilder
+from src.config import MAX_BLOCKS_PER_REQUEST
+from src.crypto import Key
+from src.proof_of_work import ProofOfWork
+from src.transaction import Transaction, TransactionInput, TransactionTarget
+from src.utils import compute_blockreward_next_block
+
+
+class StubProtocol:
+    """ Answers block requests from a fixed set of blocks, like a single peer would. """
+
+    def __init__(self, blocks):
+        self.block_receive_handlers = []
+        self.trans_receive_handlers = []
+        self.block_request_handlers = []
+        self.blocks = {b.hash: b for b in blocks}
+        self.requests = []
+        self.broadcast_count = 0
+
+    def send_block_request(self, block_hash, count=1):
+        self.requests.append((block_hash, count))
+
+    def broadcast_primary_block(self, block):
+        self.broadcast_count += 1
+
+    def broadcast_transaction(self, trans):
+        pass
+
+    def serve_requests(self):
+        """ Sends the requested blocks to the chain builder, newest first, like `received_getblocks`. """
+        served = 0
+        while served < len(self.requests):
+            block_hash, count = self.requests[served]
+            served += 1
+            for _ in range(count):
+                block = self.blocks.get(block_hash)
+                if block is None:
+                    break
+                for handler in self.block_receive_handlers:
+                    handler(block)
+                block_hash = block.prev_block_hash
+
+
+def create_chain(length, chain=None):
+    """ Mines `length` blocks on top of `chain`, or after the genesis block. """
+    key = Key.generate_private_key()
+    if chain is None:
+        chain = Blockchain()
+    blocks = []
+    # spread the blocks out in time, so that the difficulty does not increase
+    ts = chain.head.time
+    for _ in range(length):
+        ts += timedelta(seconds=2)
+        reward = compute_blockreward_next_block(chain.head.height)
+        trans = Transaction([TransactionInput(bytes(32), -1, "")],
+                            [TransactionTarget(TransactionTarget.pay_to_pubkey(key), reward)],
+                            ts, iv=chain.head.hash)
+        block = ProofOfWork(Block.create(chain.compute_target_next_block(), chain.head, [trans], ts)).run()
+        chain = chain.try_append(block)
+        assert chain is not None
+        blocks.append(block)
+    return chain, blocks
+
+
+def test_sync_in_batches():
+    chain, blocks = create_chain(MAX_BLOCKS_PER_REQUEST + 50)
+    proto = StubProtocol(blocks)
+    builder = ChainBuilder(proto)
+    chain_changes = []
+    builder.chain_change_handlers.append(lambda: chain_changes.append(builder.primary_block_chain))
+
+    appended = []
+    orig_try_append = Blockchain.try_append
+    def try_append(self, block):
+        appended.append(block)
+        return orig_try_append(self, block)
+    Blockchain.try_append = try_append
+    try:
+        builder.new_block_received(blocks[-1])
+        assert proto.requests[0][1] == MAX_BLOCKS_PER_REQUEST, "predecessors should be requested in batches"
+        proto.serve_requests()
+    finally:
+        Blockchain.try_append = orig_try_append
+        builder.shutdown()
+
+    assert builder.primary_block_chain.head.hash == chain.head.hash
+    assert len(appended) == len(blocks), "every block should be verified exactly once"
+    assert len(chain_changes) == 1 and proto.broadcast_count == 1, "the chain should be built once"
+    assert len(proto.requests) == 2, "blocks of a batch that is on its way should not be requested again"
+    assert not builder._block_requests
+
+
+def test_cache_eviction():
+    chain, blocks = create_chain(40)
+    fork_base = Blockchain()
+    for block in blocks[:10]:
+        fork_base = fork_base.try_append(block)
+    _, fork_blocks = create_chain(20, fork_base)
+
+    orig_size = src.chainbuilder.BLOCK_CACHE_SIZE
+    orig_batch = src.chainbuilder.BLOCK_CACHE_EVICTION_BATCH
+    src.chainbuilder.BLOCK_CACHE_SIZE = 5
+    src.chainbuilder.BLOCK_CACHE_EVICTION_BATCH = 0
+    builder = ChainBuilder(StubProtocol(blocks + fork_blocks))
+    try:
+        # the blocks of the fork are replaced by the main chain, which makes them evictable
+        for block in blocks[:10] + fork_blocks + blocks[10:]:
+            builder.new_block_received(block)
+    finally:
+        src.chainbuilder.BLOCK_CACHE_SIZE = orig_size
+        src.chainbuilder.BLOCK_CACHE_EVICTION_BATCH = orig_batch
+        builder.shutdown()
+
+    primary_hashes = set(builder.primary_block_chain.block_indices)
+    assert builder.primary_block_chain.head.hash == chain.head.hash
+    assert primary_hashes <= set(builder.block_cache), "blocks of the primary chain are never evicted"
+    assert len(set(builder.block_cache) - primary_hashes) <= 5
+    assert set(builder._cache_keys) == set(builder.block_cache) - primary_hashes
+    assert set(builder._ancestors) == set(builder.block_cache)
+    for block_hash, block in builder.block_cache.items():
+        if block_hash not in primary_hashes:
+            assert block.prev_block_hash in builder.block_cache, "only blocks without cached children are evicted"
+
+
+def test_cache_eviction_keeps_predecessor():
+    _, blocks = create_chain(2)
+    _, fork_blocks = create_chain(2)
+    _, orphan_blocks = create_chain(2)
+
+    orig_size = src.chainbuilder.BLOCK_CACHE_SIZE
+    src.chainbuilder.BLOCK_CACHE_SIZE = 2
+    builder = ChainBuilder(StubProtocol(blocks + fork_blocks))
+    try:
+        # the first block of the fork is replaced by the main chain, which makes it evictable, and
+        # the orphan waits for its predecessor, so the cache is full
+        for block in fork_blocks[:1] + blocks + orphan_blocks[1:]:
+            builder.new_block_received(block)
+        builder.new_block_received(fork_blocks[1])
+    finally:
+        src.chainbuilder.BLOCK_CACHE_SIZE = orig_size
+        builder.shutdown()
+
+    assert fork_blocks[0].hash in builder.block_cache, "a block is not evicted to make room for its child"
+    assert builder.primary_block_chain.head.hash == fork_blocks[1].hash
@@ -0,0 +1,19 @@
+from src.crypto import get_hasher
+from src.merkle import merkle_root_hash, merkle_tree
+
+
+class HashedValue:
+    def __init__(self, val):
+        self.val = val
+
+    def get_hash(self):
+        hasher = get_hasher()
+        hasher.update(str(self.val).encode())
+        return hasher.digest()
+
+
+def test_merkle_root_hash():
+    for count in [0, 1, 2, 3, 4, 7, 8, 33]:
+        values = [HashedValue(i) for i in range(count)]
+        assert merkle_root_hash(values) == merkle_tree(values).get_hash(), \
+            "root hash differs from the tree for {} values".format(count)